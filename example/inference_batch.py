@@ -63,8 +63,8 @@ def make_inference_unlabeled(X, cfg, input_dim, dest_dir):
                 )
                 for seq in X
             ]
-        ).astype(int)
-    ).int()
+        ).astype(np.uint8)
+    )
 
     dataset = TensorDataset(
         torch.from_numpy(
@@ -84,6 +84,7 @@ def make_inference_unlabeled(X, cfg, input_dim, dest_dir):
         dataset,
         batch_size=cfg.training.batch_size,
         num_workers=cfg.compute.n_cpu_loader,
+        pin_memory=cfg.compute.cuda,
     )
 
     device = get_accelerator(
@@ -100,6 +101,7 @@ def make_inference_unlabeled(X, cfg, input_dim, dest_dir):
         accelerator=device.type,
         devices=cfg.compute.n_gpu,
         num_nodes=cfg.compute.num_nodes,
+        precision=cfg.compute.precision,
         max_epochs=cfg.training.epochs,
         callbacks=[
             RichProgressBar(leave=True),
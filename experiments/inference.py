@@ -51,8 +51,9 @@ def setup_model(input_dim, n_tokens, cfg):
         epochs=cfg.training.epochs,
         start_learning_rate=cfg.training.learning_rate.start_learning_rate,
         peak_learning_rate=cfg.training.learning_rate.peak_learning_rate,
+        decay_steps=cfg.training.learning_rate.decay_steps,
         weight_decay=cfg.training.optimizer.weight_decay,
-        loss_fn=nn.BCELoss(),
+        loss_fn=nn.BCEWithLogitsLoss(),
         scalar_metrics=build_scalar_metrics(),
         vector_metrics=build_vector_metrics(),
         n_gpu=cfg.compute.n_gpu,
@@ -60,6 +61,8 @@ def setup_model(input_dim, n_tokens, cfg):
         steps_per_epoch=100,
         dummy_encoding=cfg.model.aegis.embedding.dummy_embedding,
         all_ones=cfg.model.aegis.embedding.all_ones,
+        compile_encoder=cfg.model.aegis.compile_encoder,
+        use_checkpoint=cfg.model.aegis.use_checkpoint,
     )
 
 
@@ -74,8 +77,8 @@ def make_inference(X, y, cfg, input_dim, dest_dir):
                 )
                 for seq in X
             ]
-        ).astype(int)
-    ).int()
+        ).astype(np.uint8)
+    )
     y = torch.from_numpy(y)
 
     dataset = TensorDataset(
@@ -97,6 +100,7 @@ def make_inference(X, y, cfg, input_dim, dest_dir):
         dataset,
         batch_size=cfg.training.batch_size,
         num_workers=cfg.compute.n_cpu_loader,
+        pin_memory=cfg.compute.cuda,
     )
     # batch_size = 5000
 
@@ -114,6 +118,7 @@ def make_inference(X, y, cfg, input_dim, dest_dir):
         accelerator=device.type,
         devices=cfg.compute.n_gpu,
         num_nodes=cfg.compute.num_nodes,
+        precision=cfg.compute.precision,
         max_epochs=cfg.training.epochs,
         callbacks=[
             RichProgressBar(leave=True),
@@ -8,6 +8,7 @@ and pseudosequence of the MHCII with which the peptide was eluted.
 
 """
 import argparse
+import hashlib
 import json
 import logging
 import os
@@ -53,13 +54,13 @@ from mhciipresentation.metrics import (
     build_vector_metrics,
 )
 from mhciipresentation.models import TransformerModel
-from mhciipresentation.paths import LOGS_DIR
+from mhciipresentation.paths import CACHE_DIR, LOGS_DIR
 from mhciipresentation.profiler import CustomAdvancedProfiler
 from mhciipresentation.utils import (
     add_peptide_context,
     check_cache,
     count_parameters,
-    encode_aa_sequences,
+    encode_and_pad_aa_sequences,
     flatten_lists,
     get_hydra_logging_directory,
     get_n_trainable_params,
@@ -94,20 +95,42 @@ cfg: DictConfig
 logger = logging.getLogger(__name__)
 
 
-def pad_sequences(
-    features: np.ndarray,
+def encode_features(
+    features: pd.Series,
     pad_width: int,
+    split: str,
 ) -> torch.Tensor:
-    # Right padding
-    seq_padded = [
-        np.pad(
-            seq,
-            pad_width=(0, pad_width - len(seq)),
-            constant_values=AA_TO_INT["X"],
-        )
-        for seq in tqdm(features)
-    ]
-    return torch.tensor(np.array(seq_padded, dtype=int))
+    """Encodes and right pads the features of a split. The encoded features
+        are cached on disk as a .npy file keyed on a hash of the features
+        and pad_width, such that a new split or padding never reuses a
+        stale cache.
+
+    Args:
+        features (pd.Series): amino acid sequences to encode
+        pad_width (int): length of the encoded sequences
+        split (str): name of the split, used to name the cache file
+
+    Returns:
+        torch.Tensor: (n_samples, pad_width) uint8 tensor of token ids
+    """
+    # Hashes both the index and the sequences of the rows in the split
+    digest = hashlib.sha1(pd.util.hash_pandas_object(features).values)
+    digest.update(str(pad_width).encode())
+    cache_file = (
+        f"{cfg.dataset.data_source}_{cfg.model.feature_set}"
+        f"_{split}_{digest.hexdigest()[:16]}_tokens.npy"
+    )
+    if cfg.compute.use_cache and check_cache(cache_file):
+        logger.info(f"Loading cached encoded features from {cache_file}")
+        # Loaded in memory rather than memory-mapped, as torch.from_numpy
+        # needs a writable array. The uint8 tokens are small enough.
+        encoded = np.load(CACHE_DIR / cache_file)
+    else:
+        # Token ids fit in uint8, which keeps host to device copies small
+        encoded = encode_and_pad_aa_sequences(features, AA_TO_INT, pad_width)
+        if cfg.compute.use_cache:
+            np.save(CACHE_DIR / cache_file, encoded)
+    return torch.from_numpy(encoded)
 
 
 def prepare_iedb_data() -> (
@@ -325,6 +348,7 @@ def train_model(
         accelerator=device.type,
         devices=cfg.compute.n_gpu,
         num_nodes=cfg.compute.num_nodes,
+        precision=cfg.compute.precision,
         max_epochs=cfg.training.epochs,
         min_steps=cfg.training.min_steps,
         callbacks=[
@@ -389,19 +413,6 @@ def main(aegiscfg: DictConfig):
     X_train, X_val, X_test, y_train, y_val, y_test = prepare_data()
     X_train, X_val, X_test = select_features(X_train, X_val, X_test)
 
-    X_train = encode_aa_sequences(
-        X_train,
-        AA_TO_INT,
-    )
-    X_val = encode_aa_sequences(
-        X_val,
-        AA_TO_INT,
-    )
-    X_test = encode_aa_sequences(
-        X_test,
-        AA_TO_INT,
-    )
-
     if cfg.model.feature_set == "seq_only":
         input_dim = 33 + 2
     elif cfg.model.feature_set == "seq_mhc":
@@ -412,6 +423,10 @@ def main(aegiscfg: DictConfig):
             "Please choose from seq_only or seq_and_mhc"
         )
 
+    X_train = encode_features(X_train, input_dim, "train")
+    X_val = encode_features(X_val, input_dim, "val")
+    X_test = encode_features(X_test, input_dim, "test")
+
     if cfg.debug.debug:
         X_train = X_train[: cfg.debug.n_samples_debug]
         X_val = X_val[: cfg.debug.n_samples_debug]
@@ -420,10 +435,6 @@ def main(aegiscfg: DictConfig):
         y_val = y_val[: cfg.debug.n_samples_debug]
         y_test = y_test[: cfg.debug.n_samples_debug]
 
-    X_train = pad_sequences(X_train, input_dim)
-    X_val = pad_sequences(X_val, input_dim)
-    X_test = pad_sequences(X_test, input_dim)
-
     X_train, y_train = shuffle_features_and_labels(X_train, y_train)
 
     # Transform labels to tensors
@@ -437,18 +448,21 @@ def main(aegiscfg: DictConfig):
         shuffle=True,
         batch_size=cfg.training.batch_size,
         num_workers=cfg.compute.n_cpu,
+        pin_memory=cfg.compute.cuda,
     )
     ValidationDataset = TensorDataset(X_val, y_val)
     val_loader = DataLoader(
         ValidationDataset,
         batch_size=cfg.training.batch_size,
         num_workers=cfg.compute.n_cpu,
+        pin_memory=cfg.compute.cuda,
     )
     TestDataset = TensorDataset(X_test, y_test)
     test_loader = DataLoader(
         TestDataset,
         batch_size=cfg.training.batch_size,
         num_workers=cfg.compute.n_cpu,
+        pin_memory=cfg.compute.cuda,
     )
 
     n_tokens = len(list(AA_TO_INT.values()))
@@ -469,8 +483,9 @@ def main(aegiscfg: DictConfig):
         epochs=cfg.training.epochs,
         start_learning_rate=cfg.training.learning_rate.start_learning_rate,
         peak_learning_rate=cfg.training.learning_rate.peak_learning_rate,
+        decay_steps=cfg.training.learning_rate.decay_steps,
         weight_decay=cfg.training.optimizer.weight_decay,
-        loss_fn=nn.BCELoss(),
+        loss_fn=nn.BCEWithLogitsLoss(),
         scalar_metrics=build_scalar_metrics(),
         vector_metrics=build_vector_metrics(),
         n_gpu=cfg.compute.n_gpu,
@@ -478,6 +493,8 @@ def main(aegiscfg: DictConfig):
         steps_per_epoch=len(train_loader),
         dummy_encoding=cfg.model.aegis.embedding.dummy_embedding,
         all_ones=cfg.model.aegis.embedding.all_ones,
+        compile_encoder=cfg.model.aegis.compile_encoder,
+        use_checkpoint=cfg.model.aegis.use_checkpoint,
     )
     tic = timer()
     logger.info(f"Training start time is {tic}")
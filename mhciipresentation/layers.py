@@ -17,9 +17,10 @@ import torch.nn.functional as F
 
 
 class PositionalEncoding(nn.Module):
-    def __init__(self, d_model, dropout=0.1, max_len=69):
+    def __init__(self, d_model, dropout=0.1, max_len=69, embed_scale=1.0):
         super().__init__()
         self.dropout = nn.Dropout(p=dropout)
+        self.embed_scale = embed_scale
 
         # Compute the positional encodings once in log space.
         pe = torch.zeros(max_len, d_model)
@@ -33,7 +34,8 @@ class PositionalEncoding(nn.Module):
         self.register_buffer("pe", pe)
 
     def forward(self, x):
-        x = x + self.pe[:, : x.size(1)]
+        # Scales the embeddings and adds the encodings in a single kernel
+        x = torch.add(self.pe[:, : x.size(1)], x, alpha=self.embed_scale)
         return self.dropout(x)
 
 
@@ -44,9 +46,11 @@ class DummyEncoding(nn.Module):
         dropout: float = 0.1,
         max_len: int = 5000,
         all_ones: bool = False,
+        embed_scale: float = 1.0,
     ):
         super().__init__()
         self.dropout = nn.Dropout(p=dropout)
+        self.embed_scale = embed_scale
 
         if not all_ones:
             pe = torch.zeros(1, max_len, d_model)
@@ -60,7 +64,7 @@ class DummyEncoding(nn.Module):
         Arguments:
             x: Tensor, shape ``[seq_len, batch_size, embedding_dim]``
         """
-        x = x + self.pe[: x.size(0)]
+        x = torch.add(self.pe[: x.size(0)], x, alpha=self.embed_scale)
         return self.dropout(x)
 
 
@@ -74,8 +78,8 @@ class FeedForward(nn.Module):
             using the representation given by the transformer encoder layer
 
         Args:
-            input_dim (int): size of the embedding used as input for the model
-                equal to embedding_size * max_seq_len.
+            input_dim (int): size of the pooled encoder representation used as
+                input for the model, equal to embedding_size.
             ff_hidden (int): hidden neurons in the hidden layers.
             dropout (float, optional): Dropout rate of the hidden layer.
                 Defaults to 0.0.
@@ -85,22 +89,33 @@ class FeedForward(nn.Module):
         self.linear_1 = nn.Linear(input_dim, ff_hidden)
         self.dropout = nn.Dropout(dropout)
         self.linear_2 = nn.Linear(ff_hidden, 1)
-        self.activation = nn.Sigmoid()
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Computes the feedforward network.
 
         Args:
             x (torch.Tensor): torch tensor of shape
-                (n_samples, embedding_size * max_seq_len)
+                (n_samples, embedding_size)
 
         Returns:
-            torch.Tensor: (n_samples, 1) prediction output
+            torch.Tensor: (n_samples, 1) logits
         """
         x = self.dropout(F.relu(self.linear_1(x)))
-        x = self.linear_2(x)
-        x = self.activation(x)
-        return x
+        return self.linear_2(x)
+
+
+def logits_to_proba(y_hat: torch.Tensor) -> torch.Tensor:
+    """Maps the logits output by FeedForward to probabilities. The sigmoid is
+        applied here rather than in the model, such that the loss can operate
+        on logits directly.
+
+    Args:
+        y_hat (torch.Tensor): logits of shape (batch_size, 1)
+
+    Returns:
+        torch.Tensor: detached float32 probabilities of shape (batch_size, 1)
+    """
+    return torch.sigmoid(y_hat.detach().float())
 
 
 class TemperatureScaling(nn.Module):
@@ -6,44 +6,78 @@
 File defining all protein language models used in this package.
 
 """
-import collections
+import contextlib
+import logging
 import math
-from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
-import matplotlib.pyplot as plt
-import pandas as pd
 import pytorch_lightning as pl
 import torch
+import torch.utils.checkpoint
 import torchmetrics
-from mhciipresentation.constants import AA_TO_INT_PTM, USE_GPU
 from mhciipresentation.layers import (
     DummyEncoding,
     FeedForward,
     PositionalEncoding,
+    logits_to_proba,
 )
-from mhciipresentation.scheduler import (
-    GradualWarmupScheduler,
-    NoamScheduler,
-    linear_warmup_decay,
-)
-from mhciipresentation.utils import prepare_batch, save_obj
-from sklearn.preprocessing import Binarizer
+from mhciipresentation.scheduler import linear_warmup_decay
 from torch import nn
-from torch.autograd import Variable
 from torch.nn import TransformerEncoder, TransformerEncoderLayer
-from torch.nn import functional as F
-from torchmetrics import (
-    AUROC,
-    ROC,
-    Accuracy,
-    ConfusionMatrix,
-    F1Score,
-    Precision,
-    PrecisionRecallCurve,
-    Recall,
-)
-from tqdm import tqdm
+
+try:
+    from torch.nn.attention import SDPBackend, sdpa_kernel
+except ImportError:  # PyTorch < 2.3
+    sdpa_kernel = None
+
+try:
+    from torch.backends.mha import get_fastpath_enabled, set_fastpath_enabled
+except ImportError:  # PyTorch < 2.2
+    set_fastpath_enabled = None
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def encoder_fastpath(enabled: bool):
+    """Temporarily disables the native fast path of the encoder layers. The
+        fast path can only be toggled from PyTorch 2.2, this is a no-op on
+        older versions.
+
+    Args:
+        enabled (bool): whether the fast path may be used
+    """
+    if enabled or set_fastpath_enabled is None:
+        yield
+        return
+    previous = get_fastpath_enabled()
+    set_fastpath_enabled(False)
+    try:
+        yield
+    finally:
+        set_fastpath_enabled(previous)
+
+
+def fused_attention_context(src: torch.Tensor):
+    """Restricts scaled_dot_product_attention to the fused FlashAttention and
+        memory-efficient kernels when running on CUDA, falling back to the
+        math kernel for inputs neither fused kernel supports.
+
+    Args:
+        src (torch.Tensor): input of the attention layers
+
+    Returns:
+        context manager selecting the attention backends
+    """
+    if sdpa_kernel is None or not src.is_cuda:
+        return contextlib.nullcontext()
+    return sdpa_kernel(
+        [
+            SDPBackend.FLASH_ATTENTION,
+            SDPBackend.EFFICIENT_ATTENTION,
+            SDPBackend.MATH,
+        ]
+    )
 
 
 class TransformerModel(pl.LightningModule):
@@ -65,15 +99,18 @@ class TransformerModel(pl.LightningModule):
         epochs: int,
         start_learning_rate: float = 0.001,
         peak_learning_rate: float = 0.01,
+        decay_steps: Optional[int] = None,
         weight_decay: float = 0.01,
-        loss_fn=nn.BCELoss(),
-        scalar_metrics: Dict[str, Any] = {},
-        vector_metrics: Dict[str, Any] = {},
+        loss_fn: Optional[nn.Module] = None,
+        scalar_metrics: Optional[Dict[str, Any]] = None,
+        vector_metrics: Optional[Dict[str, Any]] = None,
         steps_per_epoch: int = 100,
         n_gpu: int = 1,
         n_cpu: int = 1,
         dummy_encoding: bool = False,
         all_ones: bool = False,
+        compile_encoder: bool = True,
+        use_checkpoint: bool = False,
     ):
         r"""Initializes TransformerModel, including PositionalEncoding and
             TransformerEncoderLayer
@@ -89,23 +126,56 @@ class TransformerModel(pl.LightningModule):
             n_layers (int): number of transformer layers in the encoder
             dropout (float): dropout for the final feedforward layer
             device (torch.device): device used for computation
+            start_learning_rate (float): learning rate at the first step of
+                the warmup
+            peak_learning_rate (float): learning rate reached at the end of
+                the warmup
+            decay_steps (int, optional): number of steps of cosine decay
+                after the warmup, after which the learning rate stays at 0.
+                Defaults to the steps left in
+                trainer.estimated_stepping_batches.
+            loss_fn (nn.Module, optional): loss computed on the logits.
+                Defaults to nn.BCEWithLogitsLoss().
+            scalar_metrics (Dict[str, Any], optional): torchmetrics metrics
+                logged at the end of each epoch. Defaults to no metrics.
+            vector_metrics (Dict[str, Any], optional): torchmetrics metrics
+                saved by VectorLoggingCallback. Defaults to no metrics.
+            compile_encoder (bool): compiles the encoder layers with
+                torch.compile when training on CUDA
+            use_checkpoint (bool): recomputes encoder layer activations during
+                the backward pass instead of storing them. Only worth it for
+                deep encoders or long inputs where activations limit the
+                batch size.
         """
 
         super().__init__()
         self.model_type = "Transformer"
         self.seq_len = seq_len
+        self.use_checkpoint = use_checkpoint
+        self.compile_encoder = compile_encoder
+        self.compiled_layers = None
+        self.use_fastpath = True
+        embed_scale = math.sqrt(embedding_size)
         if not dummy_encoding:
             self.pos_encoder = PositionalEncoding(
-                embedding_size, dropout, seq_len
+                embedding_size, dropout, seq_len, embed_scale=embed_scale
             )
         else:
             if all_ones:
                 self.pos_encoder = DummyEncoding(
-                    embedding_size, dropout, seq_len, all_ones=all_ones
+                    embedding_size,
+                    dropout,
+                    seq_len,
+                    all_ones=all_ones,
+                    embed_scale=embed_scale,
                 )
             else:
                 self.pos_encoder = DummyEncoding(
-                    embedding_size, dropout, seq_len, all_ones=all_ones
+                    embedding_size,
+                    dropout,
+                    seq_len,
+                    all_ones=all_ones,
+                    embed_scale=embed_scale,
                 )
         encoder_layers = TransformerEncoderLayer(
             embedding_size,
@@ -122,9 +192,9 @@ class TransformerModel(pl.LightningModule):
 
         self.embedding_size = embedding_size
         self.embedding = nn.Embedding(n_tokens, self.embedding_size)
-        self.feedforward = FeedForward(
-            self.embedding_size * self.seq_len, ff_hidden, dropout
-        )
+        self.feedforward = FeedForward(self.embedding_size, ff_hidden, dropout)
+        if loss_fn is None:
+            loss_fn = nn.BCEWithLogitsLoss()
         self.loss_fn = loss_fn
         self.start_learning_rate = start_learning_rate
         self.weight_decay = weight_decay
@@ -136,10 +206,31 @@ class TransformerModel(pl.LightningModule):
         self.n_gpu = n_gpu
         self.n_cpu = n_cpu
         self.peak_learning_rate = peak_learning_rate
+        self.decay_steps = decay_steps
         self.steps_per_epoch = steps_per_epoch
-        self.init_metrics(scalar_metrics, vector_metrics)
+        self.init_metrics(
+            scalar_metrics if scalar_metrics is not None else {},
+            vector_metrics if vector_metrics is not None else {},
+        )
         self.init_weights()
 
+    def on_fit_start(self) -> None:
+        # Layers are compiled once the model is on its training device. The
+        # compiled wrappers are kept in a plain list rather than registered
+        # as submodules, which keeps state_dict keys identical to those of an
+        # uncompiled model. CPU/MPS runs and inference stay eager.
+        if not self.compile_encoder or self.device.type != "cuda":
+            return
+        if not hasattr(torch, "compile"):
+            logger.warning(
+                "compile_encoder requires torch >= 2.0, the encoder layers "
+                "are not compiled"
+            )
+            return
+        self.compiled_layers = [
+            torch.compile(layer) for layer in self.transformer_encoder.layers
+        ]
+
     def init_weights(self) -> None:
         """Uniform weight initialization"""
         initrange = 0.1
@@ -166,58 +257,147 @@ class TransformerModel(pl.LightningModule):
                     metrics[k] = v
             return metrics
 
-        self.scalar_metrics = split_metric_builder(scalar_metrics)
+        # Scalar metrics are only updated at each step and computed once at
+        # the end of each epoch. Validation runs on two dataloaders (val and
+        # test), each of which gets its own collection.
+        scalar_metrics = torchmetrics.MetricCollection(scalar_metrics)
+        self.train_metrics = scalar_metrics.clone(prefix="train_")
+        self.val_metrics = nn.ModuleList(
+            [
+                scalar_metrics.clone(
+                    prefix="val_", postfix=f"/dataloader_idx_{idx}"
+                )
+                for idx in range(2)
+            ]
+        )
+        self.test_metrics = scalar_metrics.clone(prefix="test_")
         self.vector_metrics = split_metric_builder(vector_metrics)
 
     def forward(self, data, src_padding_mask) -> torch.Tensor:
         """Defines computation to be performed for each input
 
         Args:
-            src (torch.Tensor): input data of shape (batch_size, max_seq_len)
+            src (torch.Tensor): uint8 token ids of shape
+                (batch_size, max_seq_len)
             src_padding_mask (torch.Tensor): bool mask of padding token of shape
                 (batch_size, max_seq_len)
 
         Returns:
-            torch.Tensor: output of the model
+            torch.Tensor: logits output by the model
         """
         src = data[0]
-        src = self.embedding(src) * math.sqrt(self.embedding_size)
-        src = self.pos_encoder(src)
-        src = self.transformer_encoder(
-            src, src_key_padding_mask=src_padding_mask
-        )
-        output = self.feedforward(src.view(src.size(0), -1))
-        return output.double()  # type: ignore
+        # The sqrt(embedding_size) scaling is applied by pos_encoder
+        src = self.pos_encoder(self.embedding(src.long()))
+        # Additive float mask keeps scaled_dot_product_attention on its fast
+        # path, boolean masks do not. It is built once and shared by all
+        # layers.
+        float_mask = torch.zeros_like(
+            src_padding_mask, dtype=src.dtype
+        ).masked_fill(src_padding_mask, float("-inf"))
+        with fused_attention_context(src), encoder_fastpath(
+            self.use_fastpath
+        ):
+            checkpoint_kwargs = {}
+            if sdpa_kernel is not None:
+                # Recomputation during the backward pass happens outside of
+                # this block and must use the same attention backends as the
+                # forward pass. context_fn requires torch >= 2.1, which
+                # sdpa_kernel (torch >= 2.3) implies.
+                checkpoint_kwargs["context_fn"] = lambda src=src: (
+                    fused_attention_context(src),
+                    fused_attention_context(src),
+                )
+            # Runs the compiled layers when on_fit_start compiled them, both
+            # with and without checkpointing
+            layers = self.compiled_layers or self.transformer_encoder.layers
+            for layer in layers:
+                if self.use_checkpoint and self.training:
+                    src = torch.utils.checkpoint.checkpoint(
+                        layer,
+                        src,
+                        src_key_padding_mask=float_mask,
+                        use_reentrant=False,
+                        **checkpoint_kwargs,
+                    )
+                else:
+                    src = layer(src, src_key_padding_mask=float_mask)
+        # Masked mean pooling over non-padding positions
+        mask = (~src_padding_mask).unsqueeze(-1).to(src.dtype)
+        pooled = (src * mask).sum(1) / mask.sum(1).clamp(min=1)
+        output = self.feedforward(pooled)
+        return output
+
+    def quantize_for_inference(self) -> nn.Module:
+        """Returns a copy of the model in which all linear layers use dynamic
+            int8 quantization. This reduces memory usage and speeds up
+            inference on CPU, and is not meant for training.
+
+        Example:
+            model = TransformerModel.load_from_checkpoint(...)
+            model.eval()
+            model = model.quantize_for_inference()
+            y_hat = model(batch, model.generate_padding_mask(batch))
+
+        Returns:
+            nn.Module: quantized copy of the model
+        """
+        # The native fast path of TransformerEncoderLayer reads linear1.weight
+        # as a tensor, which is a method on dynamically quantized layers.
+        # Encoder layers are thus only quantized when the fast path can be
+        # disabled (PyTorch >= 2.2), and only the feedforward head otherwise.
+        if set_fastpath_enabled is not None:
+            qconfig_spec = {nn.Linear}
+        else:
+            qconfig_spec = {"feedforward"}
+        # The copy is made without the layers compiled by on_fit_start, which
+        # would otherwise keep running the graphs traced from the float layers
+        compiled_layers, self.compiled_layers = self.compiled_layers, None
+        try:
+            quantized = torch.ao.quantization.quantize_dynamic(
+                self, qconfig_spec, dtype=torch.qint8
+            )
+        finally:
+            self.compiled_layers = compiled_layers
+        quantized.use_fastpath = False
+        return quantized
 
     def configure_optimizers(self):
+        # The learning rate ramps up linearly from start_learning_rate to
+        # peak_learning_rate over warmup_steps and then follows a cosine decay
+        # over decay_steps. Training is usually stopped early, long before
+        # estimated_stepping_batches, so decay_steps should match the number
+        # of steps a run actually lasts.
+        if self.decay_steps is not None:
+            total_steps = self.warmup_steps + self.decay_steps
+        else:
+            total_steps = self.trainer.estimated_stepping_batches
         optimizer = torch.optim.AdamW(
             self.parameters(),
-            lr=self.start_learning_rate,
+            lr=self.peak_learning_rate,
             weight_decay=self.weight_decay,
         )
 
         scheduler = {
-            "scheduler": NoamScheduler(
+            "scheduler": torch.optim.lr_scheduler.LambdaLR(
                 optimizer,
-                self.peak_learning_rate,
-                warmup_steps=self.warmup_steps,
+                linear_warmup_decay(
+                    self.warmup_steps,
+                    total_steps,
+                    cosine=True,
+                    start_factor=self.start_learning_rate
+                    / self.peak_learning_rate,
+                ),
             ),
             "interval": "step",
         }
 
         return [optimizer], [scheduler]
 
-    def compute_metrics(self, prefix, y_pred, y_true):
-        for metric in [
-            key for key in self.scalar_metrics.keys() if prefix in key
-        ]:
-            self.log(
-                f"{metric}",
-                self.scalar_metrics[metric](y_pred.cpu(), y_true).float(),
-                sync_dist=True,
-                on_epoch=True,
-                on_step=False,
-            )
+    def log_metrics(self, metrics):
+        if not any(metric.update_called for metric in metrics.values()):
+            return
+        self.log_dict(metrics.compute(), sync_dist=True)
+        metrics.reset()
 
     def generate_padding_mask(self, batch):
         src_padding_mask = batch[0] == self.pad_num
@@ -228,28 +408,27 @@ class TransformerModel(pl.LightningModule):
     def training_step(self, batch, batch_idx):
         src_padding_mask = self.generate_padding_mask(batch)
         y_hat = self(batch, src_padding_mask)
-        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).double())
+        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).float())
+        # Logged per step on the local rank only, which avoids an all-reduce
+        # at every step. Validation and test losses are aggregated over the
+        # epoch and only synchronized once it ends.
         self.log(
             "train_loss",
             loss,
-            batch_size=batch[0].shape[0],
-            sync_dist=True,
-            on_epoch=True,
-            on_step=False,
+            sync_dist=False,
+            on_epoch=False,
+            on_step=True,
         )
 
-        y_true = torch.Tensor(
-            Binarizer(threshold=0.5).transform(
-                batch[1].view(-1, 1).double().cpu()
-            )
-        )
-        self.compute_metrics("train", y_hat, y_true)
-        return {"loss": loss, "y_hat": y_hat, "y_true": y_true}
+        y_true = (batch[1].view(-1, 1) > 0.5).int()
+        y_prob = logits_to_proba(y_hat)
+        self.train_metrics.update(y_prob, y_true)
+        return {"loss": loss, "y_hat": y_prob, "y_true": y_true}
 
     def validation_step(self, batch, batch_idx, dataloader_idx=0):
         src_padding_mask = self.generate_padding_mask(batch)
         y_hat = self(batch, src_padding_mask)
-        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).double())
+        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).float())
         self.log(
             "val_loss",
             loss,
@@ -258,15 +437,12 @@ class TransformerModel(pl.LightningModule):
             on_epoch=True,
             on_step=False,
         )
-        y_true = torch.Tensor(
-            Binarizer(threshold=0.5).transform(
-                batch[1].view(-1, 1).double().cpu()
-            )
-        )
-        self.compute_metrics("val", y_hat, y_true)
+        y_true = (batch[1].view(-1, 1) > 0.5).int()
+        y_prob = logits_to_proba(y_hat)
+        self.val_metrics[dataloader_idx].update(y_prob, y_true)
         return {
             "loss": loss,
-            "y_hat": y_hat,
+            "y_hat": y_prob,
             "y_true": y_true,
             "idx": dataloader_idx,
         }
@@ -274,7 +450,7 @@ class TransformerModel(pl.LightningModule):
     def test_step(self, batch, batch_idx, dataloader_idx=1):
         src_padding_mask = self.generate_padding_mask(batch)
         y_hat = self(batch, src_padding_mask)
-        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).double())
+        loss = self.loss_fn(y_hat, batch[1].view(-1, 1).float())
         self.log(
             "test_loss",
             loss,
@@ -283,19 +459,26 @@ class TransformerModel(pl.LightningModule):
             on_epoch=True,
             on_step=False,
         )
-        y_true = torch.Tensor(
-            Binarizer(threshold=0.5).transform(
-                batch[1].view(-1, 1).double().cpu()
-            )
-        )
-        self.compute_metrics("test", y_hat, y_true)
+        y_true = (batch[1].view(-1, 1) > 0.5).int()
+        y_prob = logits_to_proba(y_hat)
+        self.test_metrics.update(y_prob, y_true)
         return {
             "loss": loss,
-            "y_hat": y_hat,
+            "y_hat": y_prob,
             "y_true": y_true,
             "idx": dataloader_idx,
         }
 
+    def on_train_epoch_end(self) -> None:
+        self.log_metrics(self.train_metrics)
+
+    def on_validation_epoch_end(self) -> None:
+        for metrics in self.val_metrics:
+            self.log_metrics(metrics)
+
+    def on_test_epoch_end(self) -> None:
+        self.log_metrics(self.test_metrics)
+
     # def on_train_epoch_end(self) -> None:
     #     if self.trainer.profiler is not None:
     #         self.trainer.profiler.dirpath.mkdir(parents=True, exist_ok=True)
@@ -311,5 +494,5 @@ class TransformerModel(pl.LightningModule):
         self, batch: Any, batch_idx: int, dataloader_idx: int = 0
     ) -> Any:
         src_padding_mask = self.generate_padding_mask(batch)
-        y_hat = self(batch, src_padding_mask)
+        y_hat = logits_to_proba(self(batch, src_padding_mask))
         return {"y_hat": y_hat}
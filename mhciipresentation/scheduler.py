@@ -20,20 +20,27 @@ class NoamScheduler(_LRScheduler):
         return [base_lr * scale * min(arg1, arg2) for base_lr in self.base_lrs]
 
 
-def linear_warmup_decay(warmup_steps, total_steps, cosine=True, linear=False):
-    """Linear warmup for warmup_steps, optionally with cosine annealing or linear decay to 0 at total_steps."""
+def linear_warmup_decay(
+    warmup_steps, total_steps, cosine=True, linear=False, start_factor=0.0
+):
+    """Linear warmup from start_factor to 1 for warmup_steps, optionally with cosine annealing or linear decay to 0 at total_steps."""
     assert not (linear and cosine)
 
     def fn(step):
         if step < warmup_steps:
-            return float(step) / float(max(1, warmup_steps))
+            return start_factor + (1.0 - start_factor) * float(step) / float(
+                max(1, warmup_steps)
+            )
 
         if not (cosine or linear):
             # no decay
             return 1.0
 
-        progress = float(step - warmup_steps) / float(
-            max(1, total_steps - warmup_steps)
+        # The factor stays at 0 once total_steps is reached
+        progress = min(
+            1.0,
+            float(step - warmup_steps)
+            / float(max(1, total_steps - warmup_steps)),
         )
         if cosine:
             # cosine decay
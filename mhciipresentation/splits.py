@@ -12,9 +12,8 @@ https://academic.oup.com/nar/article/48/W1/W449/5837056
 
 import logging
 import os
-import random
 from pathlib import Path
-from typing import Set, Tuple
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
@@ -29,25 +28,79 @@ logger = logging.getLogger(__name__)
 
 
 def remove_overlapping_peptides(
-    peptides_1: Set,
-    peptides_2: Set,
-) -> Tuple[Set, Set]:
-    """Removes peptides occuring in peptides_2 from peptides_1
+    peptides_1: np.ndarray,
+    peptides_2: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Removes peptides occuring in peptides_1 from peptides_2
 
     Args:
-        peptides_1 (np.ndarray): peptides to remove from
-        peptides_2 (np.ndarray): peptides to check against
+        peptides_1 (np.ndarray): peptides to check against
+        peptides_2 (np.ndarray): peptides to remove from
 
     Returns:
-        pd.Series: peptides_1, which does not contain elements present in
-            peptides_2
+        Tuple[np.ndarray, np.ndarray]: unique peptides_1, and unique
+            peptides_2 which does not contain elements present in peptides_1
     """
-    # Creates a difference between two sets to get the duplicate peptides as
-    # fast as possible
-    peptides_2_reduced = peptides_2.difference(peptides_1)
+    # Peptides are cast to contiguous fixed-width byte strings, such that
+    # deduplication and membership are computed by sorting raw bytes instead
+    # of hashing Python string objects
+    peptides_1 = np.unique(np.asarray(peptides_1).astype("S"))
+    peptides_2 = np.unique(np.asarray(peptides_2).astype("S"))
+    peptides_2_reduced = peptides_2[
+        np.isin(peptides_2, peptides_1, assume_unique=True, invert=True)
+    ]
 
     # Remove features and labels that correspond to duplicate peptides
-    return peptides_1, peptides_2_reduced
+    return peptides_1.astype(str), peptides_2_reduced.astype(str)
+
+
+def select_peptides(
+    data: pd.DataFrame, peptides: np.ndarray
+) -> pd.DataFrame:
+    """Selects the rows of data whose peptide is in peptides. The peptide
+        column of data is expected to be categorical, such that membership is
+        checked on its integer codes rather than on strings.
+
+    Args:
+        data (pd.DataFrame): data with a categorical peptide column
+        peptides (np.ndarray): peptides to select
+
+    Returns:
+        pd.DataFrame: rows of data corresponding to peptides
+    """
+    codes = data["peptide"].cat.categories.get_indexer(peptides)
+    return data[np.isin(data["peptide"].cat.codes.values, codes[codes >= 0])]
+
+
+def dataset_types(data: pd.DataFrame) -> np.ndarray:
+    """Determines the type of dataset each row comes from. Rows from eluted
+        ligand files are SYN (synthetic negatives) when their target value is
+        0 and EL otherwise, and rows from other files are BA (binding
+        affinity).
+
+    Args:
+        data (pd.DataFrame): data with file_name and target_value columns
+
+    Raises:
+        ValueError: if file_name is missing for some rows
+
+    Returns:
+        np.ndarray: dataset type of each row
+    """
+    # Check each distinct file name once and broadcast the result to the rows
+    # through the integer codes of the categorical
+    file_names = pd.Categorical(data["file_name"])
+    if (file_names.codes == -1).any():
+        # Code -1 would silently pick the flag of the last file name
+        raise ValueError("file_name is missing for some rows")
+    is_el_file = np.array(
+        ["_EL" in fname for fname in file_names.categories], dtype=bool
+    )[file_names.codes]
+    return np.where(
+        is_el_file,
+        np.where(data["target_value"].values == 0, "SYN", "EL"),
+        "BA",
+    )
 
 
 def validate_split(
@@ -131,31 +184,28 @@ def random_splitting(
             (i.e. validation and testing)
         val_frac (float): fraction of the evaluation set used for validation
     """
-    # *_tmp contains the data from all evaludation sets (validation + test sets)
-    X_train, X_eval, y_train, y_eval = train_test_split(
-        data.peptide.values,
-        data.target_value.values,
+    # Split unique peptides rather than rows, such that splits are disjoint by
+    # construction, and map the split of each peptide back to the rows
+    codes, uniques = pd.factorize(data.peptide)
+    train_idx, eval_idx = train_test_split(
+        np.arange(len(uniques)),
         test_size=eval_frac,
         random_state=42,
     )
-
-    # Remove peptides occuring in the test set from training set
-    X_train, X_eval = remove_overlapping_peptides(set(X_train), set(X_eval))
-    X_train_data = data[data["peptide"].isin(X_train)]
-    X_eval_data = data[data["peptide"].isin(X_eval)]
-
-    # Generate val and validation set from test set
-    X_val = X_eval_data.sample(frac=val_frac, random_state=42).X
-    peptide_test = X_eval_data.drop(X_val.index).peptide
-
-    # Remove peptides occuring in validation set from test set
-    if X_test.shape[0] != 0:
-        X_test, X_val = remove_overlapping_peptides(set(X_test), set(X_val))
-        X_test_data = data[data["peptide"].isin(X_test)]
-    else:
-        X_test_data = None
-
-    X_val_data = data[data["peptide"].isin(X_val)]
+    # eval_idx is already shuffled, so slicing it gives a random val/test split
+    val_idx, test_idx = np.split(eval_idx, [int(len(eval_idx) * val_frac)])
+
+    assignment = np.empty(len(uniques), dtype=np.int8)
+    assignment[train_idx] = 0
+    assignment[val_idx] = 1
+    assignment[test_idx] = 2
+    split_id = assignment[codes]
+
+    X_train_data = data.iloc[np.where(split_id == 0)[0]]
+    X_val_data = data.iloc[np.where(split_id == 1)[0]]
+    X_test_data = (
+        data.iloc[np.where(split_id == 2)[0]] if len(test_idx) != 0 else None
+    )
 
     if X_test_data is not None:
         validate_split(
@@ -208,17 +258,9 @@ def controlled_random_splitting(
 
         val_frac (float, optional): . Defaults to 0.5.
     """
-    ds_types = list()
-    for el in data.iterrows():
-        if "_EL" in el[1]["file_name"]:
-            if el[1]["target_value"] == 0:
-                ds_types.append("SYN")
-            else:
-                ds_types.append("EL")
-        else:
-            ds_types.append("BA")
-
-    data = data.assign(ds_type=ds_types)
+    data = data.assign(
+        ds_type=dataset_types(data), peptide=data["peptide"].astype("category")
+    )
 
     X_train = list()
     X_val = list()
@@ -266,11 +308,11 @@ def controlled_random_splitting(
             )
             if ds_type == "BA":
                 X_eval_tmp, X_train_tmp = remove_overlapping_peptides(
-                    set(X_eval_tmp), set(X_train_tmp)
+                    X_eval_tmp, X_train_tmp
                 )
             else:
                 X_train_tmp, X_eval_tmp = remove_overlapping_peptides(
-                    set(X_train_tmp), set(X_eval_tmp)
+                    X_train_tmp, X_eval_tmp
                 )
 
             logger.info("%s:" % ds_type)
@@ -280,7 +322,7 @@ def controlled_random_splitting(
             )
 
             X_val_tmp, X_test_tmp = train_test_split(
-                np.array(list(X_eval_tmp)), test_size=0.5, random_state=42
+                X_eval_tmp, test_size=0.5, random_state=42
             )
 
             X_train.extend(X_train_tmp)
@@ -290,13 +332,13 @@ def controlled_random_splitting(
             logger.info("val: %s" % len(X_val))
             logger.info("test: %s" % len(X_test))
 
-    X_train, X_val = remove_overlapping_peptides(set(X_train), set(X_val))
-    X_train, X_test = remove_overlapping_peptides(set(X_train), set(X_test))
-    X_test, X_val = remove_overlapping_peptides(set(X_test), set(X_val))
+    X_train, X_val = remove_overlapping_peptides(X_train, X_val)
+    X_train, X_test = remove_overlapping_peptides(X_train, X_test)
+    X_test, X_val = remove_overlapping_peptides(X_test, X_val)
 
-    X_train_data = data[data["peptide"].isin(X_train)]
-    X_val_data = data[data["peptide"].isin(X_val)]
-    X_test_data = data[data["peptide"].isin(X_test)]
+    X_train_data = select_peptides(data, X_train)
+    X_val_data = select_peptides(data, X_val)
+    X_test_data = select_peptides(data, X_test)
 
     validate_split(
         X_train_data.peptide, X_val_data.peptide, X_test_data.peptide
@@ -305,48 +347,116 @@ def controlled_random_splitting(
     save_idx(out_dir, X_train_data, X_val_data, X_test_data)
 
 
-def random_splitting_nod_v1(data: pd.DataFrame) -> None:
-    """We stratify by protein name.
+def split_proteins(
+    data: pd.DataFrame, val_frac: float, test_frac: float, seed: int = 42
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Randomly assigns the proteins of the positive samples to the train,
+        validation and test splits using a single seeded permutation.
 
     Args:
-        data (pd.DataFrame): dataset to stratify
+        data (pd.DataFrame): dataset containing the Uniprot accessions
+        val_frac (float): fraction of proteins used for validation
+        test_frac (float): fraction of proteins used for testing
+        seed (int): seed of the random number generator
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: train, validation and test
+            proteins
     """
-    unique_proteins = set(
-        data.loc[data.label == 1]["Uniprot Accession"].to_list()
+    # Sorting makes the permutation independent of the order of the data
+    proteins = np.sort(
+        data.loc[data.label == 1, "Uniprot Accession"].dropna().unique()
     )
-    val_proteins = set(
-        random.sample(unique_proteins, int(len(unique_proteins) * 0.1))
-    )
-    test_proteins = set(
-        random.sample(
-            unique_proteins - val_proteins, int(len(unique_proteins) * 0.1)
-        )
+    n_val = int(len(proteins) * val_frac)
+    n_test = int(len(proteins) * test_frac)
+    perm = np.random.default_rng(seed).permutation(len(proteins))
+    return (
+        proteins[perm[n_val + n_test :]],
+        proteins[perm[:n_val]],
+        proteins[perm[n_val : n_val + n_test]],
     )
-    train_proteins = unique_proteins - test_proteins.union(val_proteins)
 
-    X_train_data = data.loc[data["Uniprot Accession"].isin(train_proteins)]
-    X_val_data = data.loc[data["Uniprot Accession"].isin(val_proteins)]
-    X_test_data = data.loc[data["Uniprot Accession"].isin(test_proteins)]
 
-    X_train_data_neg = data.loc[data.label == 0].sample(len(X_train_data) * 5)
-    data = data.loc[data.label == 0].loc[
-        ~data["Peptide Sequence"].isin(
-            set(X_train_data_neg["Peptide Sequence"].to_list())
-        )
+def split_by_group(
+    data: pd.DataFrame, group_col: str, groups_per_split: List[np.ndarray]
+) -> List[pd.DataFrame]:
+    """Splits the rows of data according to the group they belong to. The
+        split of each group is computed once on the categories of group_col
+        and gathered for all rows through the categorical codes.
+
+    Args:
+        data (pd.DataFrame): data to split
+        group_col (str): column containing the group of each row
+        groups_per_split (List[np.ndarray]): disjoint groups contained in
+            each split
+
+    Returns:
+        List[pd.DataFrame]: rows of data in each split
+    """
+    groups = pd.Categorical(data[group_col])
+    # The extra last entry stays at -1 and is the one indexed by the -1 code
+    # of missing values
+    split_of_group = np.full(len(groups.categories) + 1, -1, dtype=np.int8)
+    for split, split_groups in enumerate(groups_per_split):
+        group_idx = groups.categories.get_indexer(split_groups)
+        split_of_group[group_idx[group_idx >= 0]] = split
+    split_of_row = split_of_group[groups.codes]
+    return [
+        data.iloc[np.where(split_of_row == split)[0]]
+        for split in range(len(groups_per_split))
     ]
-    X_val_data_neg = data.loc[data.label == 0].sample(len(X_val_data) * 5)
-    data = data.loc[data.label == 0].loc[
-        ~data["Peptide Sequence"].isin(
-            set(X_val_data_neg["Peptide Sequence"].to_list()).union(
-                set(X_train_data_neg["Peptide Sequence"].to_list())
-            )
-        )
+
+
+def sample_negatives(
+    data: pd.DataFrame, sizes: List[int], seed: int = 42
+) -> List[pd.DataFrame]:
+    """Samples disjoint sets of negative peptides in a single pass. Negatives
+        are drawn without replacement from rows with a unique peptide
+        sequence, such that no peptide is shared between the returned sets.
+
+    Args:
+        data (pd.DataFrame): dataset containing the negative samples
+        sizes (List[int]): number of negatives in each set
+        seed (int): seed of the random number generator
+
+    Returns:
+        List[pd.DataFrame]: one dataframe of negatives per requested size
+    """
+    neg_idx = data.index[
+        (data.label == 0) & ~data["Peptide Sequence"].duplicated()
+    ]
+    rng = np.random.default_rng(seed)
+    sampled_idx = rng.choice(neg_idx, size=sum(sizes), replace=False)
+    return [
+        data.loc[chunk]
+        for chunk in np.split(sampled_idx, np.cumsum(sizes)[:-1])
     ]
-    X_test_data_neg = data.loc[data.label == 0].sample(len(X_test_data) * 5)
 
-    X_train_data = X_train_data.append(X_train_data_neg)
-    X_val_data = X_val_data.append(X_val_data_neg)
-    X_test_data = X_test_data.append(X_test_data_neg)
+
+def random_splitting_nod_v1(data: pd.DataFrame) -> None:
+    """We stratify by protein name.
+
+    Args:
+        data (pd.DataFrame): dataset to stratify
+    """
+    train_proteins, val_proteins, test_proteins = split_proteins(
+        data, val_frac=0.1, test_frac=0.1
+    )
+
+    X_train_data, X_val_data, X_test_data = split_by_group(
+        data,
+        "Uniprot Accession",
+        [train_proteins, val_proteins, test_proteins],
+    )
+
+    X_train_data_neg, X_val_data_neg, X_test_data_neg = sample_negatives(
+        data,
+        [len(X_train_data) * 5, len(X_val_data) * 5, len(X_test_data) * 5],
+    )
+
+    X_train_data = pd.concat([X_train_data, X_train_data_neg], copy=False)
+    X_val_data = pd.concat([X_val_data, X_val_data_neg], copy=False)
+    X_test_data = pd.concat([X_test_data, X_test_data_neg], copy=False)
 
     # Summary of samples sizes
     label_dist_summary(X_train_data, "label", "training")
@@ -372,46 +482,26 @@ def random_splitting_nod_v2(
         test_frac (float): fraction of peptides used for testing
         val_frac (float): fraction of peptides used for validation
     """
-    unique_proteins = set(
-        data.loc[data.label == 1]["Uniprot Accession"].to_list()
-    )
-    val_proteins = set(
-        random.sample(
-            list(unique_proteins),
-            int(len(unique_proteins) * eval_frac * val_frac),
-        )
+    train_proteins, val_proteins, test_proteins = split_proteins(
+        data,
+        val_frac=eval_frac * val_frac,
+        test_frac=eval_frac * (1 - val_frac),
     )
-    test_proteins = set(
-        random.sample(
-            list(unique_proteins - val_proteins),
-            int(len(unique_proteins) * eval_frac * (1 - val_frac)),
-        )
-    )
-    train_proteins = unique_proteins - test_proteins.union(val_proteins)
 
-    X_train_data = data.loc[data["Uniprot Accession"].isin(train_proteins)]
-    X_val_data = data.loc[data["Uniprot Accession"].isin(val_proteins)]
-    X_test_data = data.loc[data["Uniprot Accession"].isin(test_proteins)]
+    X_train_data, X_val_data, X_test_data = split_by_group(
+        data,
+        "Uniprot Accession",
+        [train_proteins, val_proteins, test_proteins],
+    )
 
-    X_train_data_neg = data.loc[data.label == 0].sample(len(X_train_data) * 5)
-    data = data.loc[data.label == 0].loc[
-        ~data["Peptide Sequence"].isin(
-            set(X_train_data_neg["Peptide Sequence"].to_list())
-        )
-    ]
-    X_val_data_neg = data.loc[data.label == 0].sample(len(X_val_data) * 5)
-    data = data.loc[data.label == 0].loc[
-        ~data["Peptide Sequence"].isin(
-            set(X_val_data_neg["Peptide Sequence"].to_list()).union(
-                set(X_train_data_neg["Peptide Sequence"].to_list())
-            )
-        )
-    ]
-    X_test_data_neg = data.loc[data.label == 0].sample(len(X_test_data) * 5)
+    X_train_data_neg, X_val_data_neg, X_test_data_neg = sample_negatives(
+        data,
+        [len(X_train_data) * 5, len(X_val_data) * 5, len(X_test_data) * 5],
+    )
 
-    X_train_data = X_train_data.append(X_train_data_neg)
-    X_val_data = X_val_data.append(X_val_data_neg)
-    X_test_data = X_test_data.append(X_test_data_neg)
+    X_train_data = pd.concat([X_train_data, X_train_data_neg], copy=False)
+    X_val_data = pd.concat([X_val_data, X_val_data_neg], copy=False)
+    X_test_data = pd.concat([X_test_data, X_test_data_neg], copy=False)
 
     # Summary of samples sizes
     label_dist_summary(X_train_data, "label", "training")
@@ -34,6 +34,7 @@ from mhciipresentation.constants import (
     FORCE_PREPROCESSING,
     USE_GPU,
 )
+from mhciipresentation.layers import logits_to_proba
 from mhciipresentation.loaders import load_pseudosequences, load_uniprot
 from mhciipresentation.paths import CACHE_DIR
 from scipy import sparse
@@ -298,6 +299,61 @@ def encode_aa_sequences(
     )
 
 
+def encode_and_pad_aa_sequences(
+    aa_sequences: pd.Series, aa_to_int: dict, pad_width: int
+) -> np.ndarray:
+    """Encodes a given series of amino acids, adds start and stop tokens and
+        right pads the result with the token of X. Unlike
+        encode_aa_sequences, this is vectorized through a lookup table on the
+        bytes of the sequences.
+
+    Args:
+        aa_sequences (pd.Series): amino acids to encode
+        aa_to_int (dict): mapping of amino acids to integers
+        pad_width (int): length of the encoded sequences, including the start
+            and stop tokens
+
+    Raises:
+        ValueError: when a sequence contains characters that can not be
+            mapped to integers or is too long to fit in pad_width
+
+    Returns:
+        np.ndarray: (n_samples, pad_width) uint8 array of encoded sequences
+    """
+    lengths = aa_sequences.str.len().values
+    if len(lengths) != 0 and lengths.max() > pad_width - 2:
+        raise ValueError(
+            f"Sequence of length {lengths.max()} does not fit in a padding"
+            f" width of {pad_width}"
+        )
+
+    unknown = np.iinfo(np.uint8).max
+    lut = np.full(256, unknown, dtype=np.uint8)
+    for aa, idx in aa_to_int.items():
+        if len(aa) == 1:
+            lut[ord(aa)] = idx
+    # Fixed-width byte strings are padded with null bytes
+    lut[0] = aa_to_int["X"]
+
+    seq_bytes = (
+        np.asarray(aa_sequences.values, dtype=f"S{pad_width - 2}")
+        .view(np.uint8)
+        .reshape(len(aa_sequences), pad_width - 2)
+    )
+    encoded = np.empty((len(aa_sequences), pad_width), dtype=np.uint8)
+    encoded[:, 0] = aa_to_int["start"]
+    encoded[:, 1:-1] = lut[seq_bytes]
+    encoded[:, -1] = aa_to_int["X"]
+    invalid = encoded[:, 1:-1] == unknown
+    if invalid.any():
+        raise ValueError(
+            "Unsupported character(s) in sequence found:"
+            f" {set(seq_bytes[invalid].tobytes().decode())}"
+        )
+    encoded[np.arange(len(aa_sequences)), lengths + 1] = aa_to_int["stop"]
+    return encoded
+
+
 def add_peptide_context(
     peptide: pd.Series, peptide_context: pd.Series
 ) -> pd.Series:
@@ -732,7 +788,7 @@ def make_predictions_with_transformer(
             ]
 
         y_pred_batches.append(
-            model(X_batch, src_padding_mask).cpu().detach().numpy()
+            logits_to_proba(model(X_batch, src_padding_mask)).cpu().numpy()
         )
     return np.vstack(y_pred_batches)  # type: ignore
 
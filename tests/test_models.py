@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_models.py
+
+Test functions for mhciipresentation/models.py
+
+"""
+
+import torch
+
+from mhciipresentation.constants import AA_TO_INT
+from mhciipresentation.models import TransformerModel, set_fastpath_enabled
+
+
+def build_small_model():
+    torch.manual_seed(42)
+    return TransformerModel(
+        seq_len=12,
+        n_tokens=len(AA_TO_INT),
+        embedding_size=16,
+        n_attn_heads=2,
+        enc_ff_hidden=32,
+        ff_hidden=8,
+        n_layers=2,
+        dropout=0.0,
+        pad_num=AA_TO_INT["X"],
+        batch_size=4,
+        warmup_steps=1,
+        epochs=1,
+    )
+
+
+def build_batch():
+    torch.manual_seed(0)
+    src = torch.randint(1, AA_TO_INT["start"], (4, 12), dtype=torch.uint8)
+    # Right padding of various lengths
+    for idx, length in enumerate([12, 10, 7, 3]):
+        src[idx, length:] = AA_TO_INT["X"]
+    return src, torch.zeros(4)
+
+
+def test_quantize_for_inference():
+    model = build_small_model()
+    model.eval()
+    batch = build_batch()
+    with torch.no_grad():
+        expected = model(batch, model.generate_padding_mask(batch))
+        quantized = model.quantize_for_inference()
+        output = quantized(batch, quantized.generate_padding_mask(batch))
+
+    assert isinstance(
+        quantized.feedforward.linear_1,
+        torch.ao.nn.quantized.dynamic.Linear,
+    )
+    # Encoder layers are only quantized when their fast path can be disabled
+    assert isinstance(
+        quantized.transformer_encoder.layers[0].linear1,
+        torch.ao.nn.quantized.dynamic.Linear,
+    ) == (set_fastpath_enabled is not None)
+    assert quantized.compiled_layers is None
+    assert output.shape == expected.shape
+    torch.testing.assert_close(output, expected, atol=5e-2, rtol=5e-2)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_scheduler.py
+
+Test functions for mhciipresentation/scheduler.py
+
+"""
+import pytest
+
+from mhciipresentation.scheduler import linear_warmup_decay
+
+test_schedule = [
+    # (step, start_factor, expected factor)
+    (0, 0.0, 0.0),
+    (0, 0.01, 0.01),
+    (5, 0.0, 0.5),
+    (5, 0.5, 0.75),
+    (10, 0.0, 1.0),
+    (10, 0.01, 1.0),
+    (60, 0.01, 0.5),
+    (110, 0.01, 0.0),
+    (111, 0.01, 0.0),
+    (1000, 0.0, 0.0),
+]
+
+
+@pytest.mark.parametrize("step, start_factor, expected", test_schedule)
+def test_linear_warmup_decay(step, start_factor, expected):
+    """test warmup from start_factor, cosine decay and clamp at total_steps"""
+    fn = linear_warmup_decay(
+        warmup_steps=10,
+        total_steps=110,
+        cosine=True,
+        start_factor=start_factor,
+    )
+    assert fn(step) == pytest.approx(expected, abs=1e-12)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_splits.py
+
+Test functions for mhciipresentation/splits.py
+
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from mhciipresentation.splits import (
+    dataset_types,
+    random_splitting,
+    remove_overlapping_peptides,
+    sample_negatives,
+    select_peptides,
+    split_by_group,
+    split_proteins,
+)
+
+
+def build_nod_data():
+    """Builds a small NOD-like dataset with two positive peptides for each of
+    ten proteins, a positive peptide without accession and negatives, some of
+    which share their peptide sequence"""
+    positives = pd.DataFrame(
+        {
+            "Peptide Sequence": [f"POS{i:02d}" for i in range(21)],
+            "Uniprot Accession": [f"P{i // 2}" for i in range(20)] + [np.nan],
+            "label": 1,
+        }
+    )
+    negatives = pd.DataFrame(
+        {
+            "Peptide Sequence": [f"NEG{i % 25:02d}" for i in range(30)],
+            "Uniprot Accession": np.nan,
+            "label": 0,
+        }
+    )
+    return pd.concat([positives, negatives], ignore_index=True)
+
+
+@pytest.mark.parametrize(
+    "val_frac, test_frac, expected_sizes",
+    [(0.1, 0.1, (8, 1, 1)), (0.2, 0.1, (7, 2, 1)), (0.25, 0.25, (6, 2, 2))],
+)
+def test_split_proteins_sizes(val_frac, test_frac, expected_sizes):
+    """test the number of proteins of each split"""
+    splits = split_proteins(build_nod_data(), val_frac, test_frac)
+    assert tuple(len(proteins) for proteins in splits) == expected_sizes
+
+
+def test_split_proteins_disjoint():
+    """test that each positive protein is in exactly one split"""
+    data = build_nod_data()
+    train, val, test = split_proteins(data, 0.2, 0.2)
+    all_proteins = np.concatenate([train, val, test])
+    assert len(np.unique(all_proteins)) == len(all_proteins)
+    assert set(all_proteins) == set(data["Uniprot Accession"].dropna())
+
+
+def test_split_proteins_deterministic():
+    """test that the seeded permutation does not depend on the row order"""
+    data = build_nod_data()
+    shuffled = data.sample(frac=1, random_state=0)
+    for expected, actual in zip(
+        split_proteins(data, 0.2, 0.2, seed=1),
+        split_proteins(shuffled, 0.2, 0.2, seed=1),
+    ):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_split_by_group():
+    """test that rows follow the split of their protein, and that rows with
+    a missing protein are left out"""
+    data = build_nod_data()
+    groups = [np.array(["P0", "P1", "P2"]), np.array(["P3"]), np.array([])]
+    train, val, test = split_by_group(data, "Uniprot Accession", groups)
+
+    assert set(train["Uniprot Accession"]) == {"P0", "P1", "P2"}
+    assert set(val["Uniprot Accession"]) == {"P3"}
+    assert test.empty
+    assert len(train) == 6 and len(val) == 2
+    assert not set(train["Peptide Sequence"]) & set(val["Peptide Sequence"])
+    for split in [train, val, test]:
+        assert split["Uniprot Accession"].notna().all()
+
+
+def test_split_by_group_nan_unassigned():
+    """test that rows with a missing protein stay unassigned when all
+    proteins are assigned"""
+    data = build_nod_data()
+    splits = split_by_group(
+        data,
+        "Uniprot Accession",
+        list(split_proteins(data, 0.2, 0.2)),
+    )
+    assigned = pd.concat(splits)
+    assert len(assigned) == data["Uniprot Accession"].notna().sum()
+    assert "POS20" not in set(assigned["Peptide Sequence"])
+
+
+def test_sample_negatives():
+    """test the sizes and disjointness of the sampled negatives"""
+    data = build_nod_data()
+    sizes = [10, 5, 3]
+    samples = sample_negatives(data, sizes, seed=0)
+
+    assert [len(sample) for sample in samples] == sizes
+    peptides = np.concatenate(
+        [sample["Peptide Sequence"].values for sample in samples]
+    )
+    assert len(np.unique(peptides)) == len(peptides)
+    for sample in samples:
+        assert (sample.label == 0).all()
+
+    resampled = sample_negatives(data, sizes, seed=0)
+    for expected, actual in zip(samples, resampled):
+        pd.testing.assert_frame_equal(expected, actual)
+
+
+def test_select_peptides():
+    """test selection of rows through the categorical codes"""
+    data = pd.DataFrame(
+        {"peptide": ["AAA", "CCC", "AAA", "DDD"], "value": [0, 1, 2, 3]}
+    ).astype({"peptide": "category"})
+    selected = select_peptides(data, np.array(["AAA", "DDD", "EEE"]))
+    assert selected["value"].tolist() == [0, 2, 3]
+
+
+def test_remove_overlapping_peptides():
+    """test that peptides of the first argument are removed from the second"""
+    peptides_1 = np.array(["AAA", "CCC", "AAA"])
+    peptides_2 = np.array(["CCC", "DDD", "EEE", "DDD"])
+    unique_1, reduced_2 = remove_overlapping_peptides(peptides_1, peptides_2)
+    np.testing.assert_array_equal(unique_1, ["AAA", "CCC"])
+    np.testing.assert_array_equal(reduced_2, ["DDD", "EEE"])
+
+    # Swapping the arguments removes from the other set
+    unique_2, reduced_1 = remove_overlapping_peptides(peptides_2, peptides_1)
+    np.testing.assert_array_equal(unique_2, ["CCC", "DDD", "EEE"])
+    np.testing.assert_array_equal(reduced_1, ["AAA"])
+
+
+test_file_types = [
+    ("train_EL1.txt", 0.0, "SYN"),
+    ("train_EL1.txt", 1.0, "EL"),
+    ("c000_EL.txt", 0.37, "EL"),
+    ("train_BA1.txt", 0.0, "BA"),
+    ("train_BA1.txt", 0.37, "BA"),
+    ("mouse_el.txt", 0.0, "BA"),
+]
+
+
+@pytest.mark.parametrize(
+    "file_name, target_value, expected", test_file_types
+)
+def test_dataset_types(file_name, target_value, expected):
+    """test the vectorised dataset type against the per-row rule"""
+    data = pd.DataFrame(
+        {
+            "file_name": [file_name, "train_BA2.txt", "train_EL2.txt"],
+            "target_value": [target_value, 0.5, 0.0],
+        }
+    )
+    assert dataset_types(data).tolist() == [expected, "BA", "SYN"]
+
+
+def test_dataset_types_missing_file_name():
+    """test that a missing file name is rejected"""
+    data = pd.DataFrame(
+        {
+            "file_name": ["train_EL1.txt", np.nan, "train_BA1.txt"],
+            "target_value": [0.0, 1.0, 0.5],
+        }
+    )
+    with pytest.raises(ValueError):
+        dataset_types(data)
+
+
+def build_peptide_data():
+    """Builds 20 unique peptides repeated up to three times, with an index
+    that does not start at 0"""
+    peptides = [f"PEP{i:02d}" for i in range(20) for _ in range(1 + i % 3)]
+    return pd.DataFrame(
+        {
+            "peptide": peptides,
+            "target_value": np.linspace(0, 1, len(peptides)),
+        },
+        index=np.arange(100, 100 + len(peptides)),
+    )
+
+
+def read_split_peptides(data, out_dir, split):
+    idx = pd.read_csv(out_dir / f"X_{split}_idx.csv")["index"]
+    return data.loc[idx, "peptide"]
+
+
+def test_random_splitting(tmp_path):
+    """test that the splits are disjoint by peptide and cover all rows"""
+    data = build_peptide_data()
+    random_splitting(data, out_dir=tmp_path, eval_frac=0.4, val_frac=0.5)
+    splits = [
+        read_split_peptides(data, tmp_path, split)
+        for split in ["train", "val", "test"]
+    ]
+
+    assert [split.nunique() for split in splits] == [12, 4, 4]
+    for i, split_1 in enumerate(splits):
+        for split_2 in splits[i + 1 :]:
+            assert not set(split_1) & set(split_2)
+    all_idx = np.concatenate([split.index for split in splits])
+    assert sorted(all_idx) == data.index.tolist()
+
+
+def test_random_splitting_no_test(tmp_path):
+    """test that no test split is written when val_frac is 1"""
+    data = build_peptide_data()
+    random_splitting(data, out_dir=tmp_path, eval_frac=0.4, val_frac=1)
+    train = read_split_peptides(data, tmp_path, "train")
+    val = read_split_peptides(data, tmp_path, "val")
+
+    assert not (tmp_path / "X_test_idx.csv").exists()
+    assert not set(train) & set(val)
+    assert len(train) + len(val) == len(data)
@@ -15,6 +15,7 @@ from mhciipresentation.mouse.mouse import parse_protein_data
 from mhciipresentation.utils import (
     aa_seq_to_int,
     add_peptide_context,
+    encode_and_pad_aa_sequences,
     flatten_lists,
     get_peptide_context,
     join_peptide_with_pseudosequence,
@@ -357,6 +358,36 @@ def test_aa_seq_to_int(aa_seq, expected):
     assert aa_seq_to_int(aa_seq, AA_TO_INT) == expected
 
 
+test_data_encode_and_pad_aa_sequences = [
+    (peptide, 25),
+    (peptide_with_context_and_pseudosequence, 69),
+]
+
+
+@pytest.mark.parametrize(
+    "aa_sequences, pad_width", test_data_encode_and_pad_aa_sequences,
+)
+def test_encode_and_pad_aa_sequences(aa_sequences, pad_width):
+    expected = np.array(
+        [
+            np.pad(
+                aa_seq_to_int(seq, AA_TO_INT),
+                pad_width=(0, pad_width - len(seq) - 2),
+                constant_values=AA_TO_INT["X"],
+            )
+            for seq in aa_sequences
+        ]
+    )
+    encoded = encode_and_pad_aa_sequences(aa_sequences, AA_TO_INT, pad_width)
+    assert encoded.dtype == np.uint8
+    np.testing.assert_array_equal(encoded, expected)
+
+
+def test_encode_and_pad_aa_sequences_unsupported_character():
+    with pytest.raises(ValueError):
+        encode_and_pad_aa_sequences(pd.Series(["ACDB"]), AA_TO_INT, 10)
+
+
 peptides = pd.Series(data=["DLAGRDLTDY", "LKYPIEHGIITNWDDMEK", "NELRVAPEEHPV"])
 
 peptides_with_context = pd.Series(